@@ -12,43 +12,55 @@ Registro Parametri Ambientali MRI — dashboard + upload a surge.sh
 """
 import os
 import sys
+import atexit
+import re
 import json
 import shutil
+import signal
 import sqlite3
+import tempfile
 import subprocess
 import time
 import threading
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 
 # ---- SUBPROCESS WINDOWS NO-CONSOLE HELPER ----
-def _popen_no_window(cmd, **kwargs):
+_IS_WIN = sys.platform.startswith("win")
+if _IS_WIN:
+    # Creato una sola volta: Popen ne usa una copia (bpo-34044), quindi è riutilizzabile
+    _STARTUPINFO = subprocess.STARTUPINFO()
+    _STARTUPINFO.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    _STARTUPINFO.wShowWindow = 0  # SW_HIDE
+    _CREATE_NO_WINDOW = 0x08000000
+
+def _popen_no_window(cmd, capture=True, **kwargs):
     """
     Avvia un processo figlio senza aprire finestre console su Windows.
     Su altri sistemi operativi si comporta come subprocess.Popen.
     - Non usare shell=True (qui impostiamo sempre shell=False).
-    - Catturiamo stdout/stderr a PIPE per poter aggiornare la GUI.
+    - Con capture=True catturiamo stdout/stderr a PIPE per poter aggiornare la GUI;
+      con capture=False l'output viene scartato (DEVNULL), utile se serve solo il returncode.
     """
-    import subprocess, sys
     kwargs = dict(kwargs)  # copy
     kwargs.setdefault("shell", False)
-    # Assicura cattura I/O (così niente console a schermo)
+    # Assicura cattura/scarto I/O (così niente console a schermo)
     if "stdout" not in kwargs:
-        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stdout"] = subprocess.PIPE if capture else subprocess.DEVNULL
     if "stderr" not in kwargs:
-        kwargs["stderr"] = subprocess.STDOUT
+        kwargs["stderr"] = subprocess.STDOUT if capture else subprocess.DEVNULL
     if "stdin" not in kwargs and kwargs.get("text") and kwargs.get("input") is not None:
         kwargs["stdin"] = subprocess.PIPE
 
-    if sys.platform.startswith("win"):
+    if _IS_WIN:
         # HIDE window
-        si = subprocess.STARTUPINFO()
-        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        si.wShowWindow = 0  # SW_HIDE
-        CREATE_NO_WINDOW = 0x08000000
-        kwargs["startupinfo"] = si
-        kwargs["creationflags"] = (kwargs.get("creationflags", 0) | CREATE_NO_WINDOW)
+        kwargs.setdefault("startupinfo", _STARTUPINFO)
+        kwargs["creationflags"] = (kwargs.get("creationflags", 0) | _CREATE_NO_WINDOW)
     return subprocess.Popen(cmd, **kwargs)
 
 
@@ -67,6 +79,10 @@ SURGE_PASSWORD = ""
 # Cartella dashboard fissa richiesta
 DASH_FOLDER_NAME = "dashboardmri"
 DASH_DIR = os.path.join(APP_DIR, DASH_FOLDER_NAME)
+# Copie storiche della dashboard: fuori da DASH_DIR così surge carica solo i file attuali
+DASH_ARCHIVE_DIR = os.path.join(APP_DIR, DASH_FOLDER_NAME + "_storico")
+INDEX_PATH = os.path.join(DASH_DIR, "index.html")
+CHART_JS_PATH = os.path.join(DASH_DIR, "chart.umd.min.js")
 
 # Colonne per tabelle/esporti
 COLUMNS = [
@@ -81,6 +97,12 @@ COLUMNS = [
     ("operatore", "Operatore"),
 ]
 
+COL_KEYS = tuple(key for key, _ in COLUMNS)
+COL_WIDTHS = {key: (150 if key == "timestamp" else 130) for key in COL_KEYS}
+
+# Estrae i campi di un record (dict o sqlite3.Row) nell'ordine di COLUMNS con una sola chiamata
+_ROW_GET = itemgetter(*COL_KEYS)
+
 PLOT_NUM_KEYS = [
     ("o2", "O2 (%)"),
     ("rh1", "RH Umidità 1 (%)"),
@@ -112,10 +134,51 @@ def save_config(cfg: dict):
 
 # ===================== DB =====================
 
-def init_db(db_path=DB_PATH):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute(
+# Connessione SQLite unica per tutta l'app (callback Tk + thread di upload):
+# aperta una sola volta, protetta da lock, chiusa all'uscita.
+# Il lock è rientrante: chi usa la connessione la ottiene con _get_conn *dentro* il proprio
+# "with _DB_LOCK", così un ripristino (restore_db_file) non può chiuderla nel frattempo.
+_DB_LOCK = threading.RLock()
+_DB_CONN = None
+_DB_CONN_PATH = None
+
+def _reopen_locked(db_path):
+    """Chiude l'eventuale connessione e, se db_path è dato, la riapre con i PRAGMA di tuning. Richiede _DB_LOCK."""
+    global _DB_CONN, _DB_CONN_PATH
+    if _DB_CONN is not None:
+        try:
+            _DB_CONN.close()
+        finally:
+            _DB_CONN, _DB_CONN_PATH = None, None
+    if db_path is None:
+        return None
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    _DB_CONN, _DB_CONN_PATH = conn, db_path
+    return conn
+
+def _get_conn(db_path=DB_PATH):
+    """Ritorna la connessione condivisa (la apre al primo uso con i PRAGMA di tuning)."""
+    with _DB_LOCK:
+        if _DB_CONN is not None and _DB_CONN_PATH == db_path:
+            return _DB_CONN
+        return _reopen_locked(db_path)
+
+def _close_conn():
+    """Chiude la connessione condivisa (uscita app)."""
+    with _DB_LOCK:
+        _reopen_locked(None)
+
+atexit.register(_close_conn)
+
+def _create_schema(conn):
+    """Crea tabella e indice se mancano. Richiede _DB_LOCK."""
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -131,58 +194,105 @@ def init_db(db_path=DB_PATH):
         )
         """
     )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs(timestamp)")
     conn.commit()
-    conn.close()
+
+def init_db(db_path=DB_PATH):
+    with _DB_LOCK:
+        _create_schema(_get_conn(db_path))
+
+def restore_db_file(src, db_path=DB_PATH):
+    """
+    Sostituisce il DB con il backup src. Tutto avviene con _DB_LOCK acquisito: nessun altro
+    thread può riaprire il file (o ricreare il WAL) mentre è copiato solo in parte.
+    """
+    with _DB_LOCK:
+        _reopen_locked(None)
+        for suffix in ("-wal", "-shm"):
+            try:
+                os.remove(db_path + suffix)
+            except FileNotFoundError:
+                pass
+        shutil.copy2(src, db_path)
+        # Riapre la connessione (WAL + PRAGMA) e crea l'indice se il backup non lo ha
+        _create_schema(_reopen_locked(db_path))
+
+_SQL_INSERT = (
+    "INSERT INTO logs (timestamp, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_CHUNK_SIZE = 10000  # righe per transazione negli inserimenti massivi
+
+def insert_records(rows, db_path=DB_PATH):
+    """
+    Inserisce più righe (timestamp, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore)
+    con executemany, una transazione ogni INSERT_CHUNK_SIZE righe. Ritorna il numero di righe inserite.
+    """
+    it = iter(rows)
+    total = 0
+    while True:
+        chunk = list(islice(it, INSERT_CHUNK_SIZE))
+        if not chunk:
+            break
+        with _DB_LOCK:
+            conn = _get_conn(db_path)
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(_SQL_INSERT, chunk)
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+        total += len(chunk)
+    return total
 
 def insert_record(o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore, db_path=DB_PATH):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    now_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cur.execute(
-        """
-        INSERT INTO logs (timestamp, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (now_iso, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore),
-    )
-    conn.commit()
-    conn.close()
+    now_iso = datetime.now().isoformat(sep=" ", timespec="seconds")
+    insert_records([(now_iso, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore)], db_path)
     return now_iso
 
+# Testi SQL fissi: stringhe sempre identiche sfruttano la cache degli statement di sqlite3
+_SQL_SELECT = "SELECT timestamp, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore FROM logs"
+_SQL_FETCH_ALL = _SQL_SELECT + " ORDER BY timestamp ASC"
+_SQL_FETCH_RANGE = _SQL_SELECT + " WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp ASC"
+_SQL_FETCH_FROM = _SQL_SELECT + " WHERE timestamp >= ? ORDER BY timestamp ASC"
+_SQL_FETCH_UNTIL = _SQL_SELECT + " WHERE timestamp <= ? ORDER BY timestamp ASC"
+_SQL_DASH_WINDOW = (
+    " WHERE timestamp BETWEEN datetime((SELECT MAX(timestamp) FROM logs), '-30 days')"
+    " AND (SELECT MAX(timestamp) FROM logs)"
+)
+_SQL_DASHBOARD = _SQL_SELECT + _SQL_DASH_WINDOW + " ORDER BY timestamp ASC"
+# Medie giornaliere per il grafico, calcolate da SQLite quando i punti sono troppi
+_SQL_DASHBOARD_DAILY = (
+    "SELECT date(timestamp) AS d, AVG(o2), AVG(rh1), AVG(temp1), AVG(rh2), AVG(temp2) FROM logs"
+    + _SQL_DASH_WINDOW + " GROUP BY d ORDER BY d"
+)
+
 def fetch_records(start=None, end=None, db_path=DB_PATH):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    query = "SELECT timestamp, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore FROM logs"
-    params = []
-
-    if start and end:
-        query += " WHERE timestamp BETWEEN ? AND ?"
-        params.extend([normalize_to_iso(start, True), normalize_to_iso(end, False)])
-    elif start:
-        query += " WHERE timestamp >= ?"
-        params.append(normalize_to_iso(start, True))
-    elif end:
-        query += " WHERE timestamp <= ?"
-        params.append(normalize_to_iso(end, False))
-
-    query += " ORDER BY timestamp ASC"
-    cur.execute(query, params)
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
-
-def fetch_last_record():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT timestamp, o2, rh1, temp1, rh2, temp2, elio_ok, aspirazione_ok, operatore FROM logs ORDER BY timestamp DESC LIMIT 1"
+    """
+    Record nell'intervallo [start, end], date nel formato libero dei filtri ("gg/mm/aa [HH:MM]", ISO...).
+    Ritorna le righe come sqlite3.Row (accesso r["timestamp"] come un dict, senza copiarle);
+    convertire con dict(r) solo dove serve un dict vero.
+    """
+    return fetch_records_iso(
+        normalize_to_iso(start, True) if start else None,
+        normalize_to_iso(end, False) if end else None,
+        db_path,
     )
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
+
+def fetch_records_iso(start_iso=None, end_iso=None, db_path=DB_PATH):
+    """Come fetch_records, ma con estremi già normalizzati ("YYYY-MM-DD HH:MM:SS" o None)."""
+    if start_iso and end_iso:
+        query, params = _SQL_FETCH_RANGE, (start_iso, end_iso)
+    elif start_iso:
+        query, params = _SQL_FETCH_FROM, (start_iso,)
+    elif end_iso:
+        query, params = _SQL_FETCH_UNTIL, (end_iso,)
+    else:
+        query, params = _SQL_FETCH_ALL, ()
+
+    with _DB_LOCK:
+        return _get_conn(db_path).execute(query, params).fetchall()
 
 # ===================== Utils =====================
 
@@ -197,24 +307,29 @@ def parse_float(value_str: str, field_name: str) -> float:
     except Exception:
         raise ValueError(f"Il campo '{field_name}' deve essere un numero. Valore dato: '{value_str}'")
 
+# Date accettate nei filtri: ISO "aaaa-mm-gg" o italiana "gg/mm/aa[aa]", ora opzionale "HH:MM[:SS]"
+_TIME_PART = r"(?:\s+(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?$"
+_ISO_DATE_RE = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})" + _TIME_PART)
+_IT_DATE_RE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})" + _TIME_PART)
+
 def parse_it_date(s: str):
     s = s.strip()
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(s, fmt)
-        except Exception:
-            pass
-    for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y"):
-        try:
-            return datetime.strptime(s, fmt)
-        except Exception:
-            pass
-    for fmt in ("%d/%m/%y %H:%M:%S", "%d/%m/%y %H:%M", "%d/%m/%y"):
-        try:
-            return datetime.strptime(s, fmt)
-        except Exception:
-            pass
-    raise ValueError("Formato data/ora non valido. Usa es. 'gg/mm/aa' o 'gg/mm/aaaa' (opzionale 'HH:MM').")
+    m = _ISO_DATE_RE.match(s)
+    if m:
+        year, month, day = m.group(1), m.group(2), m.group(3)
+    else:
+        m = _IT_DATE_RE.match(s)
+        if not m:
+            raise ValueError("Formato data/ora non valido. Usa es. 'gg/mm/aa' o 'gg/mm/aaaa' (opzionale 'HH:MM').")
+        day, month, year = m.group(1), m.group(2), m.group(3)
+    y = int(year)
+    if len(year) == 2:
+        y += 1900 if y >= 69 else 2000  # stessa regola di strptime('%y')
+    hh, mm, ss = m.group(4), m.group(5), m.group(6)
+    try:
+        return datetime(y, int(month), int(day), int(hh or 0), int(mm or 0), int(ss or 0))
+    except ValueError:
+        raise ValueError("Formato data/ora non valido. Usa es. 'gg/mm/aa' o 'gg/mm/aaaa' (opzionale 'HH:MM').")
 
 def normalize_to_iso(s: str, start_of_day: bool) -> str:
     dt = parse_it_date(s)
@@ -224,30 +339,53 @@ def normalize_to_iso(s: str, start_of_day: bool) -> str:
             dt = dt.replace(hour=0, minute=0, second=0)
         else:
             dt = dt.replace(hour=23, minute=59, second=59)
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
+    return dt.isoformat(sep=" ", timespec="seconds")
 
+@lru_cache(maxsize=16384)
 def it_ts_display(ts_iso: str) -> str:
+    # I timestamp del DB sono sempre "YYYY-MM-DD HH:MM:SS": basta riordinare le parti
+    if len(ts_iso) == 19 and ts_iso[4] == "-" and ts_iso[13] == ":":
+        return f"{ts_iso[8:10]}/{ts_iso[5:7]}/{ts_iso[2:4]} {ts_iso[11:16]}"
     try:
         dt = datetime.strptime(ts_iso, "%Y-%m-%d %H:%M:%S")
         return dt.strftime("%d/%m/%y %H:%M")
     except Exception:
         return ts_iso
 
+# Le letture si ripetono molto (es. 21.5, 40.0): ogni valore distinto viene formattato una volta sola
+@lru_cache(maxsize=8192)
+def _format_float(v: float) -> str:
+    return f"{v:.2f}"
+
 def format_num(x) -> str:
     try:
-        return f"{float(x):.2f}"
+        # Chiave di cache normalizzata: 0/0.0/-0.0 (e 1/1.0/True) sono uguali per lru_cache,
+        # quindi il testo non deve dipendere da quale è arrivato per primo. -0.0 diventa 0.0.
+        v = float(x) + 0.0
     except Exception:
         return str(x)
+    return _format_float(v)
 
 # ===================== Export elenco (HTML/PDF) =====================
 
-def export_html(records, filepath, start=None, end=None):
-    title = "Registro Parametri Ambientali MRI"
-    period = ""
-    if start or end:
-        period = f"Intervallo: {start or '-'} → {end or '-'}"
-
-    head = f"""<!doctype html>
+# Riga tabella storico (export HTML e dashboard): ts, o2, rh1, temp1, rh2, temp2, elio, aspirazione, operatore
+_ROW_TMPL = """
+<tr>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+  <td>%s</td>
+</tr>"""
+
+# Parti statiche dell'export HTML, preparate una volta sola (solo periodo e data generazione variano)
+_EXPORT_TITLE = "Registro Parametri Ambientali MRI"
+
+_EXPORT_HEAD_TMPL = """<!doctype html>
 <html lang="it">
 <head>
 <meta charset="utf-8">
@@ -273,34 +411,31 @@ tr:nth-child(even) {{ background: #f8f9fa; }}
 <p class="meta">{period}</p>
 <table>
 <thead>
-<tr>"""
-    headers = "".join([f"<th>{label}</th>" for _, label in COLUMNS])
-    rows_html = []
-    for r in records:
-        rows_html.append(f"""
-<tr>
-  <td>{it_ts_display(r['timestamp'])}</td>
-  <td>{format_num(r['o2'])}</td>
-  <td>{format_num(r['rh1'])}</td>
-  <td>{format_num(r['temp1'])}</td>
-  <td>{format_num(r['rh2'])}</td>
-  <td>{format_num(r['temp2'])}</td>
-  <td>{r['elio_ok']}</td>
-  <td>{r['aspirazione_ok']}</td>
-  <td>{r['operatore']}</td>
-</tr>""")
-
-    tail = f"""</tr>
+<tr>""" + "".join(f"<th>{label}</th>" for _, label in COLUMNS) + """</tr>
 </thead>
 <tbody>
-{''.join(rows_html)}
+"""
+
+_EXPORT_TAIL_TMPL = """
 </tbody>
 </table>
-<div class="footer">Generato il {datetime.now().strftime('%d/%m/%y %H:%M')}</div>
+<div class="footer">Generato il {generated}</div>
 </body>
 </html>"""
+
+def export_html(records, filepath, start=None, end=None):
+    period = ""
+    if start or end:
+        period = f"Intervallo: {start or '-'} → {end or '-'}"
+
+    _ts, _fn, _tmpl = it_ts_display, format_num, _ROW_TMPL
     with open(filepath, "w", encoding="utf-8") as f:
-        f.write(head + headers + tail)
+        f.write(_EXPORT_HEAD_TMPL.format(title=_EXPORT_TITLE, period=period))
+        f.writelines(
+            _tmpl % (_ts(ts), _fn(o2), _fn(rh1), _fn(t1), _fn(rh2), _fn(t2), el, asp, op)
+            for ts, o2, rh1, t1, rh2, t2, el, asp, op in map(_ROW_GET, records)
+        )
+        f.write(_EXPORT_TAIL_TMPL.format(generated=datetime.now().strftime('%d/%m/%y %H:%M')))
 
 def export_pdf(records, filepath, start=None, end=None):
     try:
@@ -314,7 +449,7 @@ def export_pdf(records, filepath, start=None, end=None):
             "Apri un terminale e digita: python -m pip install reportlab"
         )
 
-    title = "Registro Parametri Ambientali MRI"
+    title = _EXPORT_TITLE
     period = ""
     if start or end:
         period = f"Intervallo: {start or '-'} → {end or '-'}"
@@ -329,18 +464,11 @@ def export_pdf(records, filepath, start=None, end=None):
     story.append(Spacer(1, 12))
 
     data = [[label for _, label in COLUMNS]]
-    for r in records:
-        data.append([
-            it_ts_display(r["timestamp"]),
-            format_num(r["o2"]),
-            format_num(r["rh1"]),
-            format_num(r["temp1"]),
-            format_num(r["rh2"]),
-            format_num(r["temp2"]),
-            r["elio_ok"],
-            r["aspirazione_ok"],
-            r["operatore"],
-        ])
+    _ts, _fn = it_ts_display, format_num
+    data.extend(
+        [_ts(ts), _fn(o2), _fn(rh1), _fn(t1), _fn(rh2), _fn(t2), el, asp, op]
+        for ts, o2, rh1, t1, rh2, t2, el, asp, op in map(_ROW_GET, records)
+    )
 
     table = Table(data, repeatRows=1)
     table.setStyle(TableStyle([
@@ -365,70 +493,8 @@ def export_pdf(records, filepath, start=None, end=None):
 
 # ===================== Dashboard HTML (con offline Chart.js) =====================
 
-def generate_dashboard_html(out_dir: str, use_offline: bool = False):
-    """
-    Scrive:
-      - dashboard_latest.html
-      - dashboard_YYYYmmdd_HHMMSS.html
-    Contenuto:
-      - Ultima lettura completa
-      - Storico 30 giorni precedenti
-      - Grafico Chart.js; se use_offline=True prova a usare chart.umd.min.js locale
-    """
-    if not out_dir:
-        raise RuntimeError("Cartella dashboard non impostata.")
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir, exist_ok=True)
-
-    last = fetch_last_record()
-    if not last:
-        raise RuntimeError("Nessun record presente nel database.")
-
-    last_dt = datetime.strptime(last["timestamp"], "%Y-%m-%d %H:%M:%S")
-    start_dt = last_dt - timedelta(days=30)
-    records = fetch_records(start_dt.strftime("%Y-%m-%d %H:%M:%S"), last_dt.strftime("%Y-%m-%d %H:%M:%S"))
-
-    labels = []
-    o2_vals, rh1_vals, t1_vals, rh2_vals, t2_vals = [], [], [], [], []
-    table_rows = []
-    for r in records:
-        labels.append(it_ts_display(r["timestamp"]))
-        o2_vals.append(float(r["o2"]))
-        rh1_vals.append(float(r["rh1"]))
-        t1_vals.append(float(r["temp1"]))
-        rh2_vals.append(float(r["rh2"]))
-        t2_vals.append(float(r["temp2"]))
-
-        table_rows.append(f"""
-<tr>
-  <td>{it_ts_display(r['timestamp'])}</td>
-  <td>{format_num(r['o2'])}</td>
-  <td>{format_num(r['rh1'])}</td>
-  <td>{format_num(r['temp1'])}</td>
-  <td>{format_num(r['rh2'])}</td>
-  <td>{format_num(r['temp2'])}</td>
-  <td>{r['elio_ok']}</td>
-  <td>{r['aspirazione_ok']}</td>
-  <td>{r['operatore']}</td>
-</tr>""")
-
-    import json as _json
-
-    # Decide script tag per Chart.js
-    local_chart_in_outdir = os.path.join(out_dir, "chart.umd.min.js")
-    local_chart_in_app = os.path.join(APP_DIR, "chart.umd.min.js")
-    if use_offline and os.path.exists(local_chart_in_outdir):
-        chart_tag = '<script src="chart.umd.min.js"></script>'
-    elif use_offline and os.path.exists(local_chart_in_app):
-        try:
-            shutil.copy2(local_chart_in_app, local_chart_in_outdir)
-            chart_tag = '<script src="chart.umd.min.js"></script>'
-        except Exception:
-            chart_tag = '<script src="https://cdn.jsdelivr.net/npm/chart.js"></script>'
-    else:
-        chart_tag = '<script src="https://cdn.jsdelivr.net/npm/chart.js"></script>'
-
-    html = f"""<!doctype html>
+# Dashboard scritta a blocchi: testata (.format), righe storico, dati JSON (json.dump), coda statica
+_DASH_HEAD_TMPL = """<!doctype html>
 <html lang="it">
 <head>
 <meta charset="utf-8">
@@ -467,23 +533,23 @@ def generate_dashboard_html(out_dir: str, use_offline: bool = False):
 <body>
   <div class="wrap">
     <div class="title">🏥 Dashboard Parametri Ambientali MRI - Istituto di Cura Città di Pavia - Siemens Sola 1.5T</div>
-    <div class="subtitle">Aggiornato al {it_ts_display(last['timestamp'])} — Operatore: {last['operatore']}</div>
+    <div class="subtitle">Aggiornato al {last_ts} — Operatore: {operatore}</div>
 
     <div class="grid">
       <div class="card span-6">
         <div class="title" style="font-size:18px;">Ultima lettura</div>
-        <div class="kv"><div class="k">Data/Ora</div><div class="v">{it_ts_display(last['timestamp'])}</div></div>
-        <div class="kv"><div class="k">O2 (%)</div><div class="v">{format_num(last['o2'])}</div></div>
-        <div class="kv"><div class="k">RH 1 (%)</div><div class="v">{format_num(last['rh1'])}</div></div>
-        <div class="kv"><div class="k">Temp 1 (°C)</div><div class="v">{format_num(last['temp1'])}</div></div>
-        <div class="kv"><div class="k">RH 2 (%)</div><div class="v">{format_num(last['rh2'])}</div></div>
-        <div class="kv"><div class="k">Temp 2 (°C)</div><div class="v">{format_num(last['temp2'])}</div></div>
-        <div class="kv"><div class="k">Elio</div><div class="v"><span class="badge {"ok" if last['elio_ok']=="SI" else "no"}">{last['elio_ok']}</span></div></div>
-        <div class="kv"><div class="k">Aspirazione</div><div class="v"><span class="badge {"ok" if last['aspirazione_ok']=="SI" else "no"}">{last['aspirazione_ok']}</span></div></div>
+        <div class="kv"><div class="k">Data/Ora</div><div class="v">{last_ts}</div></div>
+        <div class="kv"><div class="k">O2 (%)</div><div class="v">{o2}</div></div>
+        <div class="kv"><div class="k">RH 1 (%)</div><div class="v">{rh1}</div></div>
+        <div class="kv"><div class="k">Temp 1 (°C)</div><div class="v">{temp1}</div></div>
+        <div class="kv"><div class="k">RH 2 (%)</div><div class="v">{rh2}</div></div>
+        <div class="kv"><div class="k">Temp 2 (°C)</div><div class="v">{temp2}</div></div>
+        <div class="kv"><div class="k">Elio</div><div class="v"><span class="badge {elio_cls}">{elio_ok}</span></div></div>
+        <div class="kv"><div class="k">Aspirazione</div><div class="v"><span class="badge {asp_cls}">{aspirazione_ok}</span></div></div>
       </div>
 
       <div class="card span-6">
-        <div class="title" style="font-size:18px;">Andamento ultimi 30 giorni</div>
+        <div class="title" style="font-size:18px;">Andamento ultimi 30 giorni{chart_note}</div>
         <div class="chartbox"><canvas id="chart"></canvas></div>
       </div>
 
@@ -505,61 +571,190 @@ def generate_dashboard_html(out_dir: str, use_offline: bool = False):
               </tr>
             </thead>
             <tbody>
-              {''.join(table_rows)}
+              """
+
+_DASH_MID_TMPL = """
             </tbody>
           </table>
         </div>
       </div>
     </div>
 
-    <div class="foot">Generato automaticamente — {datetime.now().strftime('%d/%m/%y %H:%M')}</div>
+    <div class="foot">Generato automaticamente — {generated}</div>
   </div>
 
 <script>
-  const labels = {_json.dumps(labels, ensure_ascii=False)};
-  const dataO2 = {_json.dumps(o2_vals)};
-  const dataRH1 = {_json.dumps(rh1_vals)};
-  const dataT1 = {_json.dumps(t1_vals)};
-  const dataRH2 = {_json.dumps(rh2_vals)};
-  const dataT2 = {_json.dumps(t2_vals)};
+  const labels = """
+
+DASH_CHART_MAX_POINTS = 500
+
+_DASH_SERIES = ("dataO2", "dataRH1", "dataT1", "dataRH2", "dataT2")
+
+_DASH_TAIL = """;
 
   const ctx = document.getElementById('chart').getContext('2d');
-  new Chart(ctx, {{
+  new Chart(ctx, {
     type: 'line',
-    data: {{
+    data: {
       labels: labels,
       datasets: [
-        {{ label: 'O2 (%)', data: dataO2, tension: .25 }},
-        {{ label: 'RH 1 (%)', data: dataRH1, tension: .25 }},
-        {{ label: 'Temp 1 (°C)', data: dataT1, tension: .25 }},
-        {{ label: 'RH 2 (%)', data: dataRH2, tension: .25 }},
-        {{ label: 'Temp 2 (°C)', data: dataT2, tension: .25 }}
+        { label: 'O2 (%)', data: dataO2, tension: .25 },
+        { label: 'RH 1 (%)', data: dataRH1, tension: .25 },
+        { label: 'Temp 1 (°C)', data: dataT1, tension: .25 },
+        { label: 'RH 2 (%)', data: dataRH2, tension: .25 },
+        { label: 'Temp 2 (°C)', data: dataT2, tension: .25 }
       ]
-    }},
-    options: {{
+    },
+    options: {
       responsive: true,
       maintainAspectRatio: false,
-      scales: {{
-        x: {{ ticks: {{ maxRotation: 0, autoSkip: true }} }},
-        y: {{ beginAtZero: false }}
-      }}
-    }}
-  }});
+      scales: {
+        x: { ticks: { maxRotation: 0, autoSkip: true } },
+        y: { beginAtZero: false }
+      }
+    }
+  });
 </script>
 </body>
 </html>"""
 
-    ts_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+def generate_dashboard_html(out_dir: str, use_offline: bool = False, archive_dir: str = None):
+    """
+    Scrive:
+      - dashboard_latest.html (in out_dir)
+      - dashboard_YYYYmmdd_HHMMSS.html (in archive_dir, se indicata, altrimenti in out_dir)
+    Contenuto:
+      - Ultima lettura completa
+      - Storico 30 giorni precedenti
+      - Grafico Chart.js; se use_offline=True prova a usare chart.umd.min.js locale
+    """
+    if not out_dir:
+        raise RuntimeError("Cartella dashboard non impostata.")
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+
+    # Una sola query: ultimi 30 giorni rispetto al record più recente (MAX su indice)
+    with _DB_LOCK:
+        rows = _get_conn().execute(_SQL_DASHBOARD).fetchall()
+    if not rows:
+        raise RuntimeError("Nessun record presente nel database.")
+    last = dict(zip(rows[-1].keys(), rows[-1]))
+
+    # Colonne del grafico: le REAL di SQLite arrivano già come float; valori arrotondati
+    # a 2 decimali (come in tabella) per un JSON molto più compatto.
+    # Oltre DASH_CHART_MAX_POINTS letture il grafico mostra le medie giornaliere.
+    if len(rows) > DASH_CHART_MAX_POINTS:
+        with _DB_LOCK:
+            daily = _get_conn().execute(_SQL_DASHBOARD_DAILY).fetchall()
+        cols = list(zip(*daily))
+        labels = [f"{d[8:10]}/{d[5:7]}/{d[2:4]}" for d in cols[0]]
+        chart_note = " (medie giornaliere)"
+    else:
+        cols = list(zip(*rows))
+        labels = [it_ts_display(ts) for ts in cols[0]]
+        chart_note = ""
+    series = [[round(v, 2) for v in col] for col in cols[1:6]]
+
+    # Decide script tag per Chart.js
+    local_chart_in_outdir = os.path.join(out_dir, "chart.umd.min.js")
+    local_chart_in_app = os.path.join(APP_DIR, "chart.umd.min.js")
+    if use_offline and os.path.exists(local_chart_in_outdir):
+        chart_tag = '<script src="chart.umd.min.js"></script>'
+    elif use_offline and os.path.exists(local_chart_in_app):
+        try:
+            shutil.copy2(local_chart_in_app, local_chart_in_outdir)
+            chart_tag = '<script src="chart.umd.min.js"></script>'
+        except Exception:
+            chart_tag = '<script src="https://cdn.jsdelivr.net/npm/chart.js"></script>'
+    else:
+        chart_tag = '<script src="https://cdn.jsdelivr.net/npm/chart.js"></script>'
+
     path_latest = os.path.join(out_dir, "dashboard_latest.html")
-    path_ts = os.path.join(out_dir, f"dashboard_{ts_name}.html")
-    with open(path_latest, "w", encoding="utf-8") as f:
-        f.write(html)
-    with open(path_ts, "w", encoding="utf-8") as f:
-        f.write(html)
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+    # Scrive una sola volta la copia storica (a blocchi, senza costruire l'HTML intero
+    # in memoria); "latest" ne diventa un hard link. Nome con microsecondi e apertura "x":
+    # un file già pubblicato (e collegato a latest/index) non viene mai riaperto e troncato.
+    ts_name = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    path_ts = os.path.join(archive_dir or out_dir, f"dashboard_{ts_name}.html")
+    n = 1
+    while True:
+        try:
+            f = open(path_ts, "x", encoding="utf-8")
+            break
+        except FileExistsError:
+            path_ts = os.path.join(archive_dir or out_dir, f"dashboard_{ts_name}_{n}.html")
+            n += 1
+    _ts, _fn, _tmpl = it_ts_display, format_num, _ROW_TMPL
+    with f:
+        f.write(_DASH_HEAD_TMPL.format(
+            chart_tag=chart_tag,
+            chart_note=chart_note,
+            last_ts=it_ts_display(last["timestamp"]),
+            operatore=last["operatore"],
+            o2=format_num(last["o2"]),
+            rh1=format_num(last["rh1"]),
+            temp1=format_num(last["temp1"]),
+            rh2=format_num(last["rh2"]),
+            temp2=format_num(last["temp2"]),
+            elio_ok=last["elio_ok"],
+            elio_cls="ok" if last["elio_ok"] == "SI" else "no",
+            aspirazione_ok=last["aspirazione_ok"],
+            asp_cls="ok" if last["aspirazione_ok"] == "SI" else "no",
+        ))
+        f.writelines(
+            _tmpl % (_ts(ts), _fn(o2), _fn(rh1), _fn(t1), _fn(rh2), _fn(t2), el, asp, op)
+            for ts, o2, rh1, t1, rh2, t2, el, asp, op in rows
+        )
+        f.write(_DASH_MID_TMPL.format(generated=datetime.now().strftime('%d/%m/%y %H:%M')))
+        json.dump(labels, f, ensure_ascii=False)
+        for name, vals in zip(_DASH_SERIES, series):
+            f.write(f";\n  const {name} = ")
+            json.dump(vals, f)
+        f.write(_DASH_TAIL)
+    _link_or_copy(path_ts, path_latest)
     return path_latest, path_ts
 
+def _archive_old_snapshots():
+    """Sposta in DASH_ARCHIVE_DIR le copie storiche rimaste in DASH_DIR (versioni precedenti)."""
+    try:
+        names = os.listdir(DASH_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith("dashboard_") and name.endswith(".html") and name != "dashboard_latest.html":
+            try:
+                os.makedirs(DASH_ARCHIVE_DIR, exist_ok=True)
+                os.replace(os.path.join(DASH_DIR, name), os.path.join(DASH_ARCHIVE_DIR, name))
+            except OSError:
+                pass
+
+def _link_or_copy(src, dst):
+    """
+    Rende dst identico a src senza riscriverne il contenuto: hard link (o copia se il
+    filesystem non li supporta) creato accanto a dst e poi sostituito in modo atomico.
+    dst non viene mai troncato, quindi le copie storiche collegate restano intatte.
+    """
+    # Nome temporaneo univoco: due generazioni concorrenti non si contendono lo stesso file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst) or ".", prefix=".publish_", suffix=".tmp")
+    os.close(fd)
+    try:
+        os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        # Su POSIX rename() non fa nulla se tmp e dst sono già lo stesso file: tmp resterebbe
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
 # ===================== Surge helpers =====================
 
+@lru_cache(maxsize=None)
 def _possible_node_dirs():
     # Alcuni percorsi tipici su Windows per node/npm/npx
     dirs = []
@@ -584,10 +779,14 @@ def _possible_node_dirs():
         dirs.append(os.path.join(userprofile, "AppData", "Roaming", "npm"))
         # cache di npx per pacchetti scaricati
         dirs.append(os.path.join(userprofile, ".npm", "_npx"))
-    return [d for d in dict.fromkeys(dirs) if d and os.path.isdir(d)]
+    return tuple(d for d in dict.fromkeys(dirs) if d and os.path.isdir(d))
 
+@lru_cache(maxsize=None)
 def _which_executable(names):
-    """Cerca un eseguibile tra PATH e cartelle note. Ritorna percorso completo o None."""
+    """
+    Cerca un eseguibile tra PATH e cartelle note. Ritorna percorso completo o None.
+    'names' è una tupla (serve come chiave della cache: la ricerca avviene una sola volta).
+    """
     from shutil import which
     # prova PATH
     for n in names:
@@ -604,29 +803,94 @@ def _which_executable(names):
                     return cand
     return None
 
-def _run_subprocess(cmd, input_text=None, timeout=180, env=None):
+def _find_tool(*names):
+    """Come _which_executable, ma rifà la ricerca se il percorso in cache non esiste più."""
+    p = _which_executable(names)
+    if p and not os.path.isfile(p):
+        clear_tool_cache()
+        p = _which_executable(names)
+    return p
+
+def clear_tool_cache():
+    """Dimentica i percorsi di surge/npx trovati (es. dopo aver installato Node.js)."""
+    _which_executable.cache_clear()
+    _possible_node_dirs.cache_clear()
+
+def _node_env():
+    """
+    Ambiente per surge/npx: niente warning di Node, npx non chiede conferma per
+    installare surge e npm non interroga il registry per il controllo aggiornamenti.
+    """
+    env = os.environ.copy()
+    env["NODE_OPTIONS"] = (env.get("NODE_OPTIONS", "") + " --no-warnings").strip()
+    env["npm_config_yes"] = "true"
+    env["npm_config_update_notifier"] = "false"
+    return env
+
+# Processi surge/npx in esecuzione e annullamento alla chiusura dell'app: una volta impostato
+# _cancel_uploads non parte più nessun processo e deploy_to_surge si ferma al passo successivo.
+_cancel_uploads = threading.Event()
+_procs_lock = threading.Lock()
+_active_procs = set()
+
+def _kill_tree(proc):
+    """Termina proc e i suoi figli (npx/surge avviano node: uccidere solo il padre non basta)."""
     try:
-        proc = _popen_no_window(
-            cmd,
-            stdin=subprocess.PIPE if input_text is not None else None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            env=env or os.environ.copy(),
-            cwd=APP_DIR,
-        )
+        if _IS_WIN:
+            _popen_no_window(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture=False).wait(timeout=10)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)  # processo avviato in una sessione propria
+    except Exception:
+        pass
+    try:
+        proc.kill()
+    except Exception:
+        pass
+
+def _cancel_subprocesses():
+    """Vieta l'avvio di nuovi processi e termina quelli in esecuzione."""
+    with _procs_lock:
+        _cancel_uploads.set()
+        procs = list(_active_procs)
+    for proc in procs:
+        _kill_tree(proc)
+
+def _run_subprocess(cmd, input_text=None, timeout=180, env=None, capture=True):
+    """Esegue cmd e ritorna (returncode, output); output è None se capture=False."""
+    proc = None
+    try:
+        # Senza input lo stdin è chiuso (DEVNULL): un prompt inatteso del CLI termina subito
+        # invece di restare in attesa fino al timeout.
+        # Avvio e registrazione sotto lo stesso lock del controllo di annullamento: un
+        # _cancel_subprocesses concorrente non può perdere il processo appena creato.
+        with _procs_lock:
+            if _cancel_uploads.is_set():
+                return 1, "annullato"
+            proc = _popen_no_window(
+                cmd,
+                capture=capture,
+                stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+                text=True,
+                env=env or _node_env(),
+                cwd=APP_DIR,
+                start_new_session=not _IS_WIN,
+            )
+            _active_procs.add(proc)
         out, _ = proc.communicate(input=input_text, timeout=timeout)
         return proc.returncode, out
     except subprocess.TimeoutExpired:
-        try:
-            proc.kill()
-        except Exception:
-            pass
+        _kill_tree(proc)
         return 1, "Timeout esecuzione comando."
     except FileNotFoundError:
         return 1, "Comando non trovato."
     except Exception as e:
         return 1, f"Errore esecuzione comando: {e}"
+    finally:
+        _active_procs.discard(proc)
+
+# Comandi (surge o npx) con login già verificato in questa sessione: evita di
+# riavviare Node per whoami/login a ogni salvataggio. Usato solo dal worker di upload.
+_surge_authenticated = set()
 
 def _surge_login_if_needed(surge_cmd):
     """Esegue 'surge whoami' e, se non autenticato, prova login non interattivo inviando email e password."""
@@ -635,7 +899,7 @@ def _surge_login_if_needed(surge_cmd):
         return True, out
     # prova login: surge login -> invia email e password (ognuna seguita da newline)
     login_input = f"{SURGE_EMAIL}\n{SURGE_PASSWORD}\n"
-    rc2, out2 = _run_subprocess([surge_cmd, "login"], input_text=login_input, timeout=60)
+    rc2, out2 = _run_subprocess([surge_cmd, "login"], input_text=login_input, timeout=60, capture=False)
     # ritenta whoami
     rc3, out3 = _run_subprocess([surge_cmd, "whoami"], timeout=30)
     ok = (rc2 == 0 or rc3 == 0)
@@ -650,36 +914,56 @@ def deploy_to_surge(folder: str) -> (bool, str):
     Effettua login automatico se necessario.
     """
     # 1) prova surge
-    surge_cmd = _which_executable(["surge"])
+    surge_cmd = _find_tool("surge")
     if surge_cmd:
-        ok_login, log1 = _surge_login_if_needed(surge_cmd)
-        if not ok_login:
-            # proseguiamo comunque, surge farà prompt/errore
-            pass
+        if surge_cmd not in _surge_authenticated:
+            ok_login, log1 = _surge_login_if_needed(surge_cmd)
+            if ok_login:
+                _surge_authenticated.add(surge_cmd)
+            # altrimenti proseguiamo comunque, surge farà prompt/errore
+        if _cancel_uploads.is_set():
+            return False, "annullato"
         rc, out = _run_subprocess([surge_cmd, folder, SURGE_DOMAIN, "--yes"], timeout=240)
         if rc == 0:
+            _surge_authenticated.add(surge_cmd)
             return True, out
+        # token forse scaduto: al prossimo deploy si riverifica il login
+        _surge_authenticated.discard(surge_cmd)
+        if _cancel_uploads.is_set():
+            return False, "annullato"  # interrotto alla chiusura: niente ripiego su npx
         # continua provando npx se fallito
         last = f"[surge] rc={rc}\n{out}"
     else:
         last = "[surge] non trovato; provo npx"
 
     # 2) prova npx surge
-    npx_cmd = _which_executable(["npx"])
+    npx_cmd = _find_tool("npx")
     if not npx_cmd:
-        return False, last + "\n[npx] non trovato. Installa Node.js (npx) o aggiungi surge alla PATH."
+        return False, last + "\n[npx] non trovato. Installa Node.js (npx) o aggiungi surge alla PATH, poi premi 'Ricerca surge/npx'."
 
     # tentativo login con npx (potrebbe non essere necessario se auth presente in %USERPROFILE%\.surge\)
     # Non tutti gli ambienti accettano login non interattivo, ma ci proviamo.
-    rc_login, out_login = _run_subprocess([npx_cmd, "surge", "whoami"], timeout=60)
-    if rc_login != 0 or ("not logged" in (out_login or "").lower() or "no token" in (out_login or "").lower()):
-        _run_subprocess([npx_cmd, "surge", "login"], input_text=f"{SURGE_EMAIL}\n{SURGE_PASSWORD}\n", timeout=120)
+    if npx_cmd not in _surge_authenticated:
+        rc_login, out_login = _run_subprocess([npx_cmd, "surge", "whoami"], timeout=60)
+        if rc_login != 0 or ("not logged" in (out_login or "").lower() or "no token" in (out_login or "").lower()):
+            _run_subprocess([npx_cmd, "surge", "login"], input_text=f"{SURGE_EMAIL}\n{SURGE_PASSWORD}\n", timeout=120, capture=False)
 
+    if _cancel_uploads.is_set():
+        return False, "annullato"
     rc2, out2 = _run_subprocess([npx_cmd, "surge", folder, SURGE_DOMAIN, "--yes"], timeout=300)
     if rc2 == 0:
+        _surge_authenticated.add(npx_cmd)
         return True, out2
+    _surge_authenticated.discard(npx_cmd)
     return False, last + f"\n[npx surge] rc={rc2}\n{out2}"
 
+# Attesa dopo l'ultimo salvataggio prima di rigenerare e pubblicare la dashboard
+DEPLOY_DEBOUNCE_MS = 2000
+
+# Un solo worker: generazione dashboard + upload fuori dal main loop Tk,
+# salvataggi ravvicinati vengono messi in coda invece di sovrapporsi.
+_upload_executor = ThreadPoolExecutor(max_workers=1)
+
 # ===================== Finestra grafici (opzionale) =====================
 
 class ChartWindow(tk.Toplevel):
@@ -722,6 +1006,30 @@ class ChartWindow(tk.Toplevel):
         self.figure = None
         self.canvas = None
         self.ax = None
+        self.lines = {}
+        self._data = None  # dati (xs/series) da cui è costruita la figura di questa finestra
+
+        # Dati dell'ultimo grafico (tenuti dall'App): la finestra riparte da lì senza rileggere il DB.
+        # Ogni finestra ha comunque la sua Figure (dimensioni e canvas indipendenti).
+        self._app = self._root()
+        self._app.chart_windows.add(self)
+        self.bind("<Destroy>", self._on_destroy)
+        cache = self._app.chart_cache
+        if cache:
+            self.start_entry.insert(0, cache["start"] or "")
+            self.end_entry.insert(0, cache["end"] or "")
+            for k, var in self.chk_vars.items():
+                var.set(k in cache["keys"])
+            self.after_idle(self._show_cached)
+
+    def _on_destroy(self, e):
+        if e.widget is self:
+            self._app.chart_windows.discard(self)
+
+    def _show_cached(self):
+        cache = self._app.chart_cache
+        if cache and self._ensure_mpl():
+            self._build_figure(cache)
 
     def _ensure_mpl(self):
         if self._mpl_ready:
@@ -752,31 +1060,54 @@ class ChartWindow(tk.Toplevel):
             return
         start = self.start_entry.get().strip() or None
         end = self.end_entry.get().strip() or None
-        try:
-            records = fetch_records(start, end)
-        except Exception as e:
-            messagebox.showerror("Errore filtri", str(e), parent=self)
-            return
-
         selected_keys = [k for k,v in self.chk_vars.items() if v.get()]
         if not selected_keys:
             messagebox.showinfo("Selezione vuota", "Seleziona almeno un parametro da plottare.", parent=self)
             return
 
-        xs, series = [], {k: [] for k in selected_keys}
-        for r in records:
+        # Stessi filtri e parametri dei dati in cache: nessuna rilettura dal DB
+        data = self._app.chart_cache
+        if not data or (data["start"], data["end"], data["keys"]) != (start, end, tuple(selected_keys)):
             try:
-                dt = datetime.strptime(r["timestamp"], "%Y-%m-%d %H:%M:%S")
-                xs.append(dt)
-                for k in selected_keys:
-                    series[k].append(float(r[k]))
-            except Exception:
-                pass
+                start_iso = normalize_to_iso(start, True) if start else None
+                end_iso = normalize_to_iso(end, False) if end else None
+                records = fetch_records_iso(start_iso, end_iso)
+            except Exception as e:
+                messagebox.showerror("Errore filtri", str(e), parent=self)
+                return
 
-        if not xs:
-            messagebox.showinfo("Nessun dato", "Nessun record nell'intervallo.", parent=self)
-            return
+            xs, series = [], {k: [] for k in selected_keys}
+            for r in records:
+                try:
+                    dt = datetime.strptime(r["timestamp"], "%Y-%m-%d %H:%M:%S")
+                    xs.append(dt)
+                    for k in selected_keys:
+                        series[k].append(float(r[k]))
+                except Exception:
+                    pass
+
+            if not xs:
+                messagebox.showinfo("Nessun dato", "Nessun record nell'intervallo.", parent=self)
+                return
+
+            data = {
+                "start": start, "end": end, "keys": tuple(selected_keys),
+                "start_iso": start_iso, "end_iso": end_iso, "xs": xs, "series": series,
+            }
+            self._app.chart_cache = data
+
+        self._build_figure(data)
+
+        if not self._embed_ok:
+            messagebox.showinfo(
+                "Nota",
+                "Il backend TkAgg non è disponibile: il grafico non può essere integrato nella finestra.\n"
+                "Puoi comunque salvarlo come PNG con il pulsante 'Salva PNG'.",
+                parent=self
+            )
 
+    def _build_figure(self, data):
+        """Crea la figura di questa finestra dai dati indicati (sostituendo l'eventuale precedente)."""
         if self.canvas:
             try:
                 self.canvas.get_tk_widget().destroy()
@@ -784,12 +1115,20 @@ class ChartWindow(tk.Toplevel):
                 pass
             self.canvas = None
 
-        self.figure = self._Figure(figsize=(11, 5.8), dpi=100)
+        # Layout "tight" rifatto a ogni draw: etichette non tagliate anche dopo il resize della
+        # finestra, e savefig non deve fare un secondo render per bbox_inches="tight"
+        try:
+            self.figure = self._Figure(figsize=(11, 5.8), dpi=100, layout="tight")
+        except TypeError:  # matplotlib < 3.5
+            self.figure = self._Figure(figsize=(11, 5.8), dpi=100, tight_layout=True)
         self.ax = self.figure.add_subplot(111)
 
         label_map = dict(PLOT_NUM_KEYS)
-        for k in selected_keys:
-            self.ax.plot(xs, series[k], label=label_map.get(k, k))
+        self.lines = {}
+        for k in data["keys"]:
+            # Linee dati rasterizzate, assi ed etichette restano vettoriali
+            (line,) = self.ax.plot(data["xs"], data["series"][k], label=label_map.get(k, k), rasterized=True)
+            self.lines[k] = line
 
         self.ax.set_xlabel("Data/Ora")
         self.ax.set_ylabel("Valore")
@@ -799,24 +1138,27 @@ class ChartWindow(tk.Toplevel):
             self.figure.autofmt_xdate()
         except Exception:
             pass
+        self._data = data
 
         if self._embed_ok:
             try:
                 self.canvas = self._FigureCanvasTkAgg(self.figure, master=self.canvas_frame)
-                self.canvas.draw()
+                # Render rimandato al ciclo idle di Tk: si accorpa con resize e aggiornamenti
+                self.canvas.draw_idle()
                 self.canvas.get_tk_widget().pack(fill="both", expand=True)
             except Exception:
                 self._embed_ok = False
 
         self.btn_save_png.config(state="normal")
 
-        if not self._embed_ok:
-            messagebox.showinfo(
-                "Nota",
-                "Il backend TkAgg non è disponibile: il grafico non può essere integrato nella finestra.\n"
-                "Puoi comunque salvarlo come PNG con il pulsante 'Salva PNG'.",
-                parent=self
-            )
+    def refresh_lines(self):
+        """Riallinea le linee ai dati (dopo l'aggiunta di nuovi punti) e ridisegna al prossimo idle."""
+        for k, line in self.lines.items():
+            line.set_data(self._data["xs"], self._data["series"][k])
+        self.ax.relim()
+        self.ax.autoscale_view()
+        if self.canvas:
+            self.canvas.draw_idle()
 
     def save_png(self):
         if not self.figure:
@@ -832,7 +1174,7 @@ class ChartWindow(tk.Toplevel):
         if not filepath:
             return
         try:
-            self.figure.savefig(filepath, dpi=150, bbox_inches="tight")
+            self.figure.savefig(filepath, dpi=150)
             messagebox.showinfo("Fatto", f"Grafico salvato in:\n{filepath}", parent=self)
         except Exception as e:
             messagebox.showerror("Errore salvataggio", f"Impossibile salvare il grafico:\n{e}")
@@ -849,14 +1191,9 @@ class ModernCard(ttk.Frame):
         self.content.pack(fill="both", expand=True, padx=10, pady=(0, 10))
 
 class AnimatedButton(ttk.Button):
-    def __init__(self, parent, **kwargs):
-        super().__init__(parent, **kwargs)
-        self.bind("<Enter>", self._on_enter)
-        self.bind("<Leave>", self._on_leave)
-    def _on_enter(self, _e):
-        self.configure(style="Hover.TButton")
-    def _on_leave(self, _e):
-        self.configure(style="Modern.TButton")
+    # L'effetto hover è negli stati "active"/"pressed" degli stili (style.map in configure_styles):
+    # lo gestisce ttk, senza callback <Enter>/<Leave> né cambi di stile per ogni passaggio del mouse.
+    pass
 
 def configure_styles(root):
     style = ttk.Style()
@@ -884,17 +1221,226 @@ def configure_styles(root):
                     background=color_secondary,
                     borderwidth=0,
                     padding=(15, 8))
-    style.map("Modern.TButton", background=[("pressed", color_primary), ("active", color_primary)])
-    style.configure("Hover.TButton", background=color_primary, padding=(15, 8))
     style.configure("Success.TButton", background=color_success, foreground=color_white, padding=(15, 8))
     style.configure("Warning.TButton", background=color_warning, foreground=color_white, padding=(15, 8))
     style.configure("Danger.TButton", background=color_danger, foreground=color_white, padding=(15, 8))
+    # Hover/pressione: stesso colore scuro per tutti i pulsanti, mappato una volta sola
+    for name in ("Modern.TButton", "Success.TButton", "Warning.TButton", "Danger.TButton"):
+        style.map(name, background=[("pressed", color_primary), ("active", color_primary)])
 
     style.configure("Modern.TEntry", fieldbackground=color_white, borderwidth=2, relief="solid", padding=6)
     style.configure("Modern.TRadiobutton", background=color_white, foreground=color_primary, font=("Segoe UI", 10))
 
 # ===================== Viewer (elenco + export) =====================
 
+def run_in_background(widget, work, on_done, on_error=None):
+    """
+    Esegue work() su un thread separato (es. letture DB) e richiama on_done(risultato)
+    oppure on_error(eccezione) sul thread di Tk tramite widget.after.
+    """
+    def _worker():
+        try:
+            cb, arg = on_done, work()
+        except Exception as e:
+            cb, arg = on_error, e
+        if cb is None:
+            return
+        try:
+            widget.after(0, cb, arg)
+        except (RuntimeError, tk.TclError):
+            pass  # finestra già chiusa
+    threading.Thread(target=_worker, daemon=True).start()
+
+def _format_rows(records):
+    """Converte i record in tuple di stringhe pronte per la Treeview (un solo passaggio)."""
+    _ts, _fn = it_ts_display, format_num
+    return [
+        (_ts(ts), _fn(o2), _fn(rh1), _fn(t1), _fn(rh2), _fn(t2), el, asp, op)
+        for ts, o2, rh1, t1, rh2, t2, el, asp, op in map(_ROW_GET, records)
+    ]
+
+class VirtualRows:
+    """
+    Treeview "virtualizzata": la lista completa di righe (tuple già formattate) resta in
+    Python e nel widget vengono inserite solo quelle visibili. La scrollbar verticale
+    scorre sull'intera lista; scorrendo si cancellano/inseriscono solo le righe che
+    entrano o escono dalla finestra visibile. Il costo non dipende dal numero di record.
+    Selezione e focus sono tenuti per indice di riga e riapplicati a ogni scorrimento.
+    """
+
+    def __init__(self, tree, vsb):
+        self.tree = tree
+        self.vsb = vsb
+        self.rows = []
+        self.first = 0
+        self._shown_first = 0
+        self._row_h = None
+        self._head_h = 0
+        self.selected = set()    # indici (in self.rows) delle righe selezionate
+        self._focus_idx = None
+        self._applied = set()    # iid selezionati dall'ultimo _render (non dall'utente)
+        self._extend = False     # ultimo click/tasto con Shift/Ctrl: la selezione si estende
+        try:
+            self._row_h = int(ttk.Style().lookup("Treeview", "rowheight")) or None
+        except (ValueError, tk.TclError):
+            pass
+        vsb.configure(command=self._on_scrollbar)
+        tree.bind("<Configure>", lambda _e: self._render())
+        tree.bind("<MouseWheel>", self._on_wheel)
+        tree.bind("<Button-4>", lambda _e: self.scroll(-3))
+        tree.bind("<Button-5>", lambda _e: self.scroll(3))
+        tree.bind("<Prior>", lambda _e: self.scroll(-self._capacity()))
+        tree.bind("<Next>", lambda _e: self.scroll(self._capacity()))
+        tree.bind("<Home>", lambda _e: self.scroll(-len(self.rows)))
+        tree.bind("<End>", lambda _e: self.scroll(len(self.rows)))
+        tree.bind("<Up>", lambda e: self._on_arrow(e, -1))
+        tree.bind("<Down>", lambda e: self._on_arrow(e, 1))
+        tree.bind("<ButtonPress-1>", self._track_modifiers, add="+")
+        tree.bind("<KeyPress>", self._track_modifiers, add="+")
+        tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+
+    def set_rows(self, rows):
+        """Sostituisce tutte le righe e torna all'inizio dell'elenco."""
+        self.rows = rows
+        self.first = 0
+        self.selected = set()
+        self._focus_idx = None
+        self._clear()
+        self._render()
+
+    def append(self, row, follow=False):
+        """
+        Aggiunge una riga in fondo all'elenco senza ricaricarlo. La vista scorre fino alla
+        nuova riga se era già in fondo, oppure sempre con follow=True.
+        """
+        at_bottom = self.first + self._capacity() >= len(self.rows)
+        self.rows.append(row)
+        if follow or at_bottom:
+            self.first = len(self.rows)  # _render lo riporta all'ultima finestra valida
+        self._render()
+
+    def scroll(self, n):
+        self.first += n
+        self._render()
+        return "break"
+
+    def _capacity(self):
+        if self._head_h == 0:
+            children = self.tree.get_children()
+            bbox = self.tree.bbox(children[0]) if children else ""
+            if bbox:
+                self._head_h, self._row_h = bbox[1], bbox[3]
+        height = self.tree.winfo_height() - (self._head_h or 24)
+        return max(1, height // (self._row_h or 20))
+
+    def _clear(self):
+        children = self.tree.get_children()
+        if children:
+            self.tree.delete(*children)
+        self._shown_first = 0
+
+    def _render(self):
+        cap = self._capacity()
+        total = len(self.rows)
+        self.first = max(0, min(self.first, total - cap))
+        new_first, new_last = self.first, min(total, self.first + cap + 1)  # +1: riga parziale in fondo
+
+        call, w = self.tree.tk.call, self.tree._w
+        items = self.tree.get_children()
+        old_first = self._shown_first
+        old_last = old_first + len(items)
+        if items and new_first < old_last and old_first < new_last:
+            # Finestre sovrapposte: tocca solo le righe che entrano/escono
+            drop_top = max(0, new_first - old_first)
+            drop_bottom = max(0, old_last - new_last)
+            drop = items[:drop_top] + (items[len(items) - drop_bottom:] if drop_bottom else ())
+            if drop:
+                self.tree.delete(*drop)
+            for k, i in enumerate(range(new_first, min(old_first, new_last))):
+                call(w, "insert", "", k, "-values", self.rows[i])
+            for i in range(max(old_last, new_first), new_last):
+                call(w, "insert", "", "end", "-values", self.rows[i])
+        else:
+            self._clear()
+            for i in range(new_first, new_last):
+                call(w, "insert", "", "end", "-values", self.rows[i])
+        self._shown_first = new_first
+        self.tree.yview_moveto(0)
+
+        # Riapplica selezione e focus alle righe (eventualmente reinserite) della finestra
+        items = self.tree.get_children()
+        sel = [items[i - new_first] for i in self.selected if new_first <= i < new_last]
+        self.tree.selection_set(sel)
+        self._applied = set(sel)
+        if self._focus_idx is not None and new_first <= self._focus_idx < new_last:
+            self.tree.focus(items[self._focus_idx - new_first])
+
+        if total <= cap:
+            self.vsb.set(0, 1)
+        else:
+            self.vsb.set(new_first / total, min(1.0, (new_first + cap) / total))
+
+    def _track_modifiers(self, e):
+        self._extend = bool(e.state & 0x0005) and str(self.tree.cget("selectmode")) == "extended"
+
+    def _on_select(self, _e=None):
+        items = self.tree.get_children()
+        lo = self._shown_first
+        pos = {iid: lo + k for k, iid in enumerate(items)}
+        focus = self.tree.focus()
+        if focus in pos:
+            self._focus_idx = pos[focus]
+        current = self.tree.selection()
+        if set(current) == self._applied:
+            return  # selezione impostata da _render, non dall'utente
+        visible = {pos[iid] for iid in current if iid in pos}
+        if self._extend:
+            # Shift/Ctrl: restano selezionate anche le righe fuori dalla finestra visibile
+            hi = lo + len(items)
+            visible.update(i for i in self.selected if not lo <= i < hi)
+        self.selected = visible
+        self._applied = set(current)
+
+    def _on_arrow(self, e, step):
+        """Su/Giù oltre il bordo della finestra visibile: scorre di una riga e sposta focus/selezione."""
+        # <Up>/<Down> prevalgono su <KeyPress>: i modificatori vanno letti qui (servono anche a
+        # _on_select quando la Treeview gestisce da sé lo spostamento dentro la finestra)
+        self._track_modifiers(e)
+        focus = self.tree.focus()
+        if not focus:
+            return None
+        target = self._shown_first + self.tree.index(focus) + step
+        if not 0 <= target < len(self.rows):
+            return "break"
+        if self.first <= target < self.first + self._capacity():
+            return None  # riga ancora visibile per intero: gestione standard della Treeview
+        self.scroll(step)
+        items = self.tree.get_children()
+        k = target - self._shown_first
+        if 0 <= k < len(items):
+            self.tree.focus(items[k])
+            if self._extend:
+                self.tree.selection_add(items[k])
+            else:
+                self.tree.selection_set(items[k])
+            self.tree.see(items[k])
+        return "break"
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.first = int(float(args[1]) * len(self.rows))
+            self._render()
+        elif args[0] == "scroll":
+            step = self._capacity() if args[2] == "pages" else 1
+            self.scroll(int(args[1]) * step)
+
+    def _on_wheel(self, e):
+        notches = int(e.delta / 120) or (1 if e.delta > 0 else -1)
+        return self.scroll(-3 * notches)
+
+# Caratteri dei filtri data non adatti ai nomi file, sostituiti in un solo passaggio
+_FN_TRANS = str.maketrans({" ": "_", ":": "-", "/": "-"})
+
 class Viewer(tk.Toplevel):
     def __init__(self, master):
         super().__init__(master)
@@ -929,16 +1475,16 @@ class Viewer(tk.Toplevel):
         frm_table = ttk.Frame(self, style="Main.TFrame", padding=(8,0,8,8))
         frm_table.pack(fill="both", expand=True)
 
-        cols = [key for key, _ in COLUMNS]
-        self.tree = ttk.Treeview(frm_table, columns=cols, show="headings", selectmode="extended")
+        self.tree = ttk.Treeview(frm_table, columns=COL_KEYS, show="headings", selectmode="extended")
         for key, label in COLUMNS:
             self.tree.heading(key, text=label, anchor="center")
-            width = 150 if key == "timestamp" else 130
-            self.tree.column(key, width=width, anchor="center")
+            self.tree.column(key, width=COL_WIDTHS[key], anchor="center")
 
-        vsb = ttk.Scrollbar(frm_table, orient="vertical", command=self.tree.yview)
+        vsb = ttk.Scrollbar(frm_table, orient="vertical")
         hsb = ttk.Scrollbar(frm_table, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscroll=vsb.set, xscroll=hsb.set)
+        self.tree.configure(xscroll=hsb.set)
+        # Solo le righe visibili stanno nel widget; la scrollbar verticale la gestisce VirtualRows
+        self.tree_rows = VirtualRows(self.tree, vsb)
 
         self.tree.grid(row=0, column=0, sticky="nsew")
         vsb.grid(row=0, column=1, sticky="ns")
@@ -947,6 +1493,7 @@ class Viewer(tk.Toplevel):
         frm_table.rowconfigure(0, weight=1)
         frm_table.columnconfigure(0, weight=1)
 
+        self._refresh_seq = 0
         self.refresh()
 
     def get_filters(self):
@@ -954,90 +1501,82 @@ class Viewer(tk.Toplevel):
         end = self.end_entry.get().strip() or None
         return start, end
 
+    def get_iso_filters(self):
+        """Filtri convertiti una sola volta in timestamp ISO per la query (ValueError se non validi)."""
+        start, end = self.get_filters()
+        return (
+            normalize_to_iso(start, True) if start else None,
+            normalize_to_iso(end, False) if end else None,
+        )
+
     def refresh(self):
         try:
-            start, end = self.get_filters()
-            records = fetch_records(start, end)
-        except Exception as e:
+            start_iso, end_iso = self.get_iso_filters()
+        except ValueError as e:
             messagebox.showerror("Errore filtri", str(e), parent=self)
             return
-
-        for iid in self.tree.get_children():
-            self.tree.delete(iid)
-
-        for r in records:
-            values = [
-                it_ts_display(r["timestamp"]),
-                format_num(r["o2"]),
-                format_num(r["rh1"]),
-                format_num(r["temp1"]),
-                format_num(r["rh2"]),
-                format_num(r["temp2"]),
-                r["elio_ok"],
-                r["aspirazione_ok"],
-                r["operatore"],
-            ]
-            self.tree.insert("", "end", values=values)
+        self._refresh_seq += 1
+        seq = self._refresh_seq
+        def _done(rows):
+            if seq == self._refresh_seq:  # ignora risultati di refresh superati
+                self.tree_rows.set_rows(rows)
+        run_in_background(
+            self,
+            lambda: _format_rows(fetch_records_iso(start_iso, end_iso)),
+            _done,
+            lambda e: messagebox.showerror("Errore filtri", str(e), parent=self),
+        )
 
     def do_export_html(self):
-        start, end = self.get_filters()
-        try:
-            records = fetch_records(start, end)
-        except Exception as e:
-            messagebox.showerror("Errore", str(e), parent=self)
-            return
-        if not records:
-            messagebox.showinfo("Nessun dato", "Non ci sono record per l'intervallo selezionato.", parent=self)
-            return
-        default_name = (
-            f"registro_MRI_{(start or 'inizio')}_to_{(end or 'fine')}.html"
-            .replace(" ", "_").replace(":", "-").replace("/", "-")
-        )
-        filepath = filedialog.asksaveasfilename(
-            parent=self,
-            title="Salva come HTML",
-            defaultextension=".html",
-            filetypes=[("HTML", "*.html")],
-            initialfile=default_name,
-        )
-        if not filepath:
-            return
-        try:
-            export_html(records, filepath, start, end)
-            messagebox.showinfo("Fatto", f"Esportazione HTML completata:\n{filepath}", parent=self)
-        except Exception as e:
-            messagebox.showerror("Errore esportazione", str(e), parent=self)
+        self._export("html", "HTML", export_html)
 
     def do_export_pdf(self):
+        self._export("pdf", "PDF", export_pdf)
+
+    def _export(self, ext, label, export_fn):
+        """Lettura record e scrittura file in background; dialoghi sul thread di Tk."""
         start, end = self.get_filters()
         try:
-            records = fetch_records(start, end)
-        except Exception as e:
+            start_iso, end_iso = self.get_iso_filters()
+        except ValueError as e:
             messagebox.showerror("Errore", str(e), parent=self)
             return
-        if not records:
-            messagebox.showinfo("Nessun dato", "Non ci sono record per l'intervallo selezionato.", parent=self)
-            return
-        default_name = (
-            f"registro_MRI_{(start or 'inizio')}_to_{(end or 'fine')}.pdf"
-            .replace(" ", "_").replace(":", "-").replace("/", "-")
-        )
-        filepath = filedialog.asksaveasfilename(
-            parent=self,
-            title="Salva come PDF",
-            defaultextension=".pdf",
-            filetypes=[("PDF", "*.pdf")],
-            initialfile=default_name,
+
+        def _fetched(records):
+            if not records:
+                messagebox.showinfo("Nessun dato", "Non ci sono record per l'intervallo selezionato.", parent=self)
+                return
+            default_name = f"registro_MRI_{(start or 'inizio')}_to_{(end or 'fine')}.{ext}".translate(_FN_TRANS)
+            filepath = filedialog.asksaveasfilename(
+                parent=self,
+                title=f"Salva come {label}",
+                defaultextension=f".{ext}",
+                filetypes=[(label, f"*.{ext}")],
+                initialfile=default_name,
+            )
+            if not filepath:
+                return
+            progress = ProgressDialog(self, f"Esportazione {label} in corso…")
+
+            def _exported(_result):
+                progress.close()
+                messagebox.showinfo("Fatto", f"Esportazione {label} completata:\n{filepath}", parent=self)
+
+            def _failed(e):
+                progress.close()
+                if isinstance(e, RuntimeError) and export_fn is export_pdf:
+                    messagebox.showwarning("ReportLab mancante", str(e), parent=self)
+                else:
+                    messagebox.showerror("Errore esportazione", str(e), parent=self)
+
+            run_in_background(self, lambda: export_fn(records, filepath, start, end), _exported, _failed)
+
+        run_in_background(
+            self,
+            lambda: fetch_records_iso(start_iso, end_iso),
+            _fetched,
+            lambda e: messagebox.showerror("Errore", str(e), parent=self),
         )
-        if not filepath:
-            return
-        try:
-            export_pdf(records, filepath, start, end)
-            messagebox.showinfo("Fatto", f"Esportazione PDF completata:\n{filepath}", parent=self)
-        except RuntimeError as re:
-            messagebox.showwarning("ReportLab mancante", str(re), parent=self)
-        except Exception as e:
-            messagebox.showerror("Errore esportazione", str(e), parent=self)
 
     def open_chart(self):
         ChartWindow(self)
@@ -1045,6 +1584,9 @@ class Viewer(tk.Toplevel):
 # ===================== App principale =====================
 
 
+# Operazioni più brevi di così chiudono il dialogo prima che la barra inizi ad animarsi
+PROGRESS_ANIM_DELAY_MS = 300
+
 class ProgressDialog(tk.Toplevel):
     def __init__(self, master, message="Operazione in corso…"):
         super().__init__(master)
@@ -1059,17 +1601,33 @@ class ProgressDialog(tk.Toplevel):
         self.label.pack(fill="x", pady=(0,10))
         self.pb = ttk.Progressbar(frm, mode="indeterminate", length=320)
         self.pb.pack(fill="x")
+        # L'animazione gira sul clock di Tk: avviata solo dopo PROGRESS_ANIM_DELAY_MS
+        self._anim_id = self.after(PROGRESS_ANIM_DELAY_MS, self._start_anim)
+        self._pending_msg = None
+        self._flush_id = None
+        self.update_idletasks()
+
+    def _start_anim(self):
+        self._anim_id = None
         try:
             self.pb.start(10)
         except Exception:
             pass
-        self.update_idletasks()
 
     def set_message(self, msg:str):
-        self.label.config(text=msg)
-        self.update_idletasks()
+        # Messaggi ravvicinati vengono accorpati: la label si aggiorna al massimo ogni 100 ms
+        self._pending_msg = msg
+        if self._flush_id is None:
+            self._flush_id = self.after(100, self._flush_message)
+
+    def _flush_message(self):
+        self._flush_id = None
+        self.label.config(text=self._pending_msg)
 
     def close(self):
+        for after_id in (self._anim_id, self._flush_id):
+            if after_id is not None:
+                self.after_cancel(after_id)
         try:
             self.pb.stop()
         except Exception:
@@ -1196,16 +1754,16 @@ class App(tk.Tk):
         table_frame = ttk.Frame(reg_card.content, style="Card.TFrame")
         table_frame.pack(fill="both", expand=True, pady=8)
 
-        cols = [key for key, _ in COLUMNS]
-        self.main_tree = ttk.Treeview(table_frame, columns=cols, show="headings", selectmode="browse")
+        self.main_tree = ttk.Treeview(table_frame, columns=COL_KEYS, show="headings", selectmode="browse")
         for key, label in COLUMNS:
             self.main_tree.heading(key, text=label, anchor="center")
-            width = 150 if key == "timestamp" else 130
-            self.main_tree.column(key, width=width, anchor="center")
+            self.main_tree.column(key, width=COL_WIDTHS[key], anchor="center")
 
-        vsb = ttk.Scrollbar(table_frame, orient="vertical", command=self.main_tree.yview)
+        vsb = ttk.Scrollbar(table_frame, orient="vertical")
         hsb = ttk.Scrollbar(table_frame, orient="horizontal", command=self.main_tree.xview)
-        self.main_tree.configure(yscroll=vsb.set, xscroll=hsb.set)
+        self.main_tree.configure(xscroll=hsb.set)
+        # Solo le righe visibili stanno nel widget; la scrollbar verticale la gestisce VirtualRows
+        self.main_tree_rows = VirtualRows(self.main_tree, vsb)
 
         self.main_tree.grid(row=0, column=0, sticky="nsew")
         vsb.grid(row=0, column=1, sticky="ns")
@@ -1230,6 +1788,7 @@ class App(tk.Tk):
         b7 = AnimatedButton(bottom_bar, text="🌐 Imposta cartella dashboard…", command=self.set_dashboard_dir, style="Warning.TButton")
         b8 = AnimatedButton(bottom_bar, text="🧪 Rigenera dashboard ora", command=self.manual_generate_dashboard, style="Modern.TButton")
         b9 = AnimatedButton(bottom_bar, text="⬇️ Copia Chart.js offline…", command=self.copy_chart_js_to_dashboard, style="Modern.TButton")
+        b10 = AnimatedButton(bottom_bar, text="🔧 Ricerca surge/npx", command=self.refresh_tools, style="Modern.TButton")
 
         b1.grid(row=0, column=0, sticky="ew", padx=6, pady=4)
         b2.grid(row=0, column=1, sticky="ew", padx=6, pady=4)
@@ -1239,12 +1798,22 @@ class App(tk.Tk):
         b6.grid(row=1, column=1, sticky="ew", padx=6, pady=4)
         b7.grid(row=1, column=2, sticky="ew", padx=6, pady=4)
         b8.grid(row=1, column=3, sticky="ew", padx=6, pady=4)
-        b9.grid(row=2, column=0, columnspan=4, sticky="ew", padx=6, pady=4)
+        b9.grid(row=2, column=0, columnspan=2, sticky="ew", padx=6, pady=4)
+        b10.grid(row=2, column=2, columnspan=2, sticky="ew", padx=6, pady=4)
 
         self.status = tk.StringVar(value="Pronto")
         ttk.Label(main_container, textvariable=self.status, relief="sunken", anchor="w").pack(fill="x", pady=(10,0))
 
         self.operatore_var.trace_add("write", self._limit_operatore)
+        self._registry_seq = 0
+        self._registry_loaded_seq = -1
+        self._deploy_after_id = None
+        self._close_after_deploy = False
+        self._deploys_in_flight = 0
+        self._manual_gen_in_flight = 0
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.chart_cache = None  # dati dell'ultimo grafico, riusati tra le aperture di ChartWindow
+        self.chart_windows = set()  # ChartWindow aperte, aggiornate da _append_chart_point
         self.refresh_main_registry()
 
         # Aggiorna label posizione dashboard predefinita (fissa in APP_DIR)
@@ -1287,53 +1856,101 @@ class App(tk.Tk):
             self.status.set(f"Registrazione salvata alle {it_ts_display(ts_iso)}")
             messagebox.showinfo("Salvato", f"Registrazione salvata alle {it_ts_display(ts_iso)}")
             self._clear_fields()
-            self.refresh_main_registry()
-
-            # 1) genera/aggiorna dashboard in APP_DIR/dashboardmri + index.html
-            latest, tsfile = self._generate_dashboard_to_fixed_dir()
-
-            
-            # 2) esegue upload su surge.sh con finestra di attesa
-            self.status.set("Caricamento su surge.sh in corso…")
-            progress = ProgressDialog(self, "Attendere il caricamento online della dashboard…\nNon chiudere l'applicazione.")
-            def _worker():
-                ok, log = deploy_to_surge(DASH_DIR)
-                def _done():
-                    try:
-                        progress.close()
-                    except Exception:
-                        pass
-                    if ok:
-                        self.status.set("Dashboard pubblicata su surge.sh")
-                        messagebox.showinfo("Surge", "✅ Pubblicazione completata su:\n" + SURGE_DOMAIN)
-                    else:
-                        self.status.set("Errore pubblicazione surge.sh")
-                        snippet = (log or "").strip()
-                        if len(snippet) > 1500:
-                            snippet = snippet[:1500] + "..."
-                        messagebox.showwarning("Surge", "⚠️ Pubblicazione non riuscita.\n\nDettagli:\n" + snippet)
-                self.after(0, _done)
-            threading.Thread(target=_worker, daemon=True).start()
+            rec = {
+                "timestamp": ts_iso, "o2": o2, "rh1": rh1, "temp1": temp1, "rh2": rh2, "temp2": temp2,
+                "elio_ok": elio_ok, "aspirazione_ok": aspirazione_ok, "operatore": operatore,
+            }
+            self._append_row(rec)
+            self._append_chart_point(rec)
+
+            # Dashboard + upload rimandati di DEPLOY_DEBOUNCE_MS: salvataggi ravvicinati
+            # producono una sola rigenerazione/pubblicazione con lo stato più recente.
+            if self._deploy_after_id is not None:
+                self.after_cancel(self._deploy_after_id)
+            self._deploy_after_id = self.after(DEPLOY_DEBOUNCE_MS, self._do_deploy)
 
         except ValueError as ve:
             messagebox.showerror("Errore di validazione", str(ve))
         except Exception as e:
             messagebox.showerror("Errore", f"Si è verificato un errore: {e}")
 
-    def _generate_dashboard_to_fixed_dir(self):
+    def _on_close(self):
+        # Pubblicazione ancora in attesa del debounce: l'ultima registrazione non è sulla
+        # dashboard. La si avvia subito e l'app si chiude a pubblicazione terminata.
+        if self._deploy_after_id is not None:
+            self.after_cancel(self._deploy_after_id)
+            self._close_after_deploy = True
+            self._do_deploy()
+            return
+        # Upload in corso: i worker dell'executor non sono daemon, quindi senza intervento il
+        # processo resterebbe vivo (senza finestra) fino al timeout di surge.
+        if self._deploys_in_flight:
+            if not messagebox.askyesno(
+                "Caricamento in corso",
+                "La dashboard è in fase di caricamento su surge.sh.\nInterrompere e chiudere l'applicazione?",
+                icon="warning",
+            ):
+                return
+            _cancel_subprocesses()
+            _upload_executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+    def _do_deploy(self):
+        self._deploy_after_id = None
+        # 1) genera/aggiorna dashboard in APP_DIR/dashboardmri + index.html
+        # 2) esegue upload su surge.sh con finestra di attesa
+        # Entrambi sul thread di upload, così la GUI resta reattiva.
+        self.status.set("Aggiornamento dashboard e caricamento su surge.sh in corso…")
+        progress = ProgressDialog(self, "Attendere il caricamento online della dashboard…\nNon chiudere l'applicazione.")
+        use_offline = bool(self.config_data.get("chart_offline"))
+        self._deploys_in_flight += 1
+        def _done(ok, log):
+            self._deploys_in_flight -= 1
+            try:
+                progress.close()
+            except Exception:
+                pass
+            if ok:
+                self.status.set("Dashboard pubblicata su surge.sh")
+                messagebox.showinfo("Surge", "✅ Pubblicazione completata su:\n" + SURGE_DOMAIN)
+            else:
+                self.status.set("Errore pubblicazione surge.sh")
+                snippet = (log or "").strip()
+                if len(snippet) > 1500:
+                    snippet = snippet[:1500] + "..."
+                messagebox.showwarning("Surge", "⚠️ Pubblicazione non riuscita.\n\nDettagli:\n" + snippet)
+            if self._close_after_deploy and not self._deploys_in_flight:
+                self.destroy()
+        def _worker():
+            result = self._generate_and_deploy(use_offline)
+            try:
+                self.after(0, _done, *result)
+            except (RuntimeError, tk.TclError):
+                pass  # finestra già chiusa
+        _upload_executor.submit(_worker)
+
+    def _generate_and_deploy(self, use_offline):
+        """
+        Eseguito sul thread di upload: rigenera la dashboard e la pubblica su surge.
+        Ritorna (ok, log).
+        """
+        try:
+            self._generate_dashboard_to_fixed_dir(use_offline)
+        except Exception as e:
+            return False, f"Impossibile generare la dashboard:\n{e}"
+        return deploy_to_surge(DASH_DIR)
+
+    def _generate_dashboard_to_fixed_dir(self, use_offline=None):
         # Crea cartella se manca
         os.makedirs(DASH_DIR, exist_ok=True)
         # Genera dashboard (usa preferenza offline)
-        latest, tsfile = generate_dashboard_html(DASH_DIR, use_offline=bool(self.config_data.get("chart_offline")))
-        # Copia/aggiorna index.html dalla versione latest
-        try:
-            index_path = os.path.join(DASH_DIR, "index.html")
-            shutil.copy2(latest, index_path)
-        except Exception:
-            # Se per qualche motivo non riesce a copiare, tenta a scrivere direttamente
-            with open(os.path.join(DASH_DIR, "index.html"), "w", encoding="utf-8") as f:
-                with open(latest, "r", encoding="utf-8") as src:
-                    f.write(src.read())
+        if use_offline is None:
+            use_offline = bool(self.config_data.get("chart_offline"))
+        latest, tsfile = generate_dashboard_html(DASH_DIR, use_offline=use_offline, archive_dir=DASH_ARCHIVE_DIR)
+        _archive_old_snapshots()
+        # Aggiorna index.html dalla versione latest: hard link + rename atomico, nessuna copia
+        # del contenuto e nessun istante in cui l'upload può leggere un index.html a metà
+        _link_or_copy(latest, INDEX_PATH)
         return latest, tsfile
 
     def _clear_fields(self):
@@ -1354,29 +1971,46 @@ class App(tk.Tk):
     def open_chart_and_prompt_save(self):
         ChartWindow(self)
 
-    def refresh_main_registry(self):
-        try:
-            records = fetch_records()
-        except Exception as e:
-            messagebox.showerror("Errore lettura registro", str(e), parent=self)
-            return
+    def refresh_main_registry(self, show_last=False):
+        self._registry_seq += 1
+        seq = self._registry_seq
+        def _done(rows):
+            if seq == self._registry_seq:  # ignora risultati di refresh superati
+                self.main_tree_rows.set_rows(rows)
+                if show_last:
+                    self.main_tree_rows.scroll(len(rows))
+                self._registry_loaded_seq = seq
+        run_in_background(
+            self,
+            lambda: _format_rows(fetch_records()),
+            _done,
+            lambda e: messagebox.showerror("Errore lettura registro", str(e), parent=self),
+        )
 
-        for iid in self.main_tree.get_children():
-            self.main_tree.delete(iid)
-
-        for r in records:
-            values = [
-                it_ts_display(r["timestamp"]),
-                format_num(r["o2"]),
-                format_num(r["rh1"]),
-                format_num(r["temp1"]),
-                format_num(r["rh2"]),
-                format_num(r["temp2"]),
-                r["elio_ok"],
-                r["aspirazione_ok"],
-                r["operatore"],
-            ]
-            self.main_tree.insert("", "end", values=values)
+    def _append_chart_point(self, rec):
+        """Aggiunge il nuovo record ai dati dei grafici (cache e finestre aperte) che lo includono."""
+        datasets = {id(d): d for d in [self.chart_cache] + [w._data for w in self.chart_windows] if d}
+        ts = rec["timestamp"]
+        changed = set()
+        for key, data in datasets.items():
+            if (data["start_iso"] and ts < data["start_iso"]) or (data["end_iso"] and ts > data["end_iso"]):
+                continue
+            data["xs"].append(datetime.strptime(ts, "%Y-%m-%d %H:%M:%S"))
+            for k in data["keys"]:
+                data["series"][k].append(float(rec[k]))
+            changed.add(key)
+        for win in self.chart_windows:
+            if win._data is not None and id(win._data) in changed:
+                win.refresh_lines()
+
+    def _append_row(self, rec):
+        """Dopo un salvataggio aggiunge solo la nuova riga al registro, senza rileggere tutto il DB."""
+        if self._registry_loaded_seq != self._registry_seq:
+            # un caricamento completo è ancora in corso e potrebbe non contenere il nuovo record
+            self.refresh_main_registry(show_last=True)
+            return
+        # Il registro è in ordine cronologico: la riga appena salvata è in fondo, la si mostra
+        self.main_tree_rows.append(_format_rows([rec])[0], follow=True)
 
     # ------- Backup / Ripristino --------
 
@@ -1394,7 +2028,11 @@ class App(tk.Tk):
             )
             if not filepath:
                 return
-            shutil.copy2(DB_PATH, filepath)
+            # In WAL le ultime scritture possono essere ancora nel file -wal: le riversa nel DB prima di copiarlo
+            # (copia sotto lock: nessuna scrittura fra checkpoint e copia)
+            with _DB_LOCK:
+                _get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                shutil.copy2(DB_PATH, filepath)
             messagebox.showinfo("Backup completato", f"Backup salvato in:\n{filepath}")
         except Exception as e:
             messagebox.showerror("Errore backup", f"Impossibile eseguire il backup:\n{e}")
@@ -1411,13 +2049,21 @@ class App(tk.Tk):
             if not os.path.exists(filepath):
                 messagebox.showerror("File non trovato", "Il file selezionato non esiste.")
                 return
+            # La dashboard in generazione/caricamento legge il DB: niente ripristino nel frattempo
+            if self._deploy_after_id is not None or self._deploys_in_flight or self._manual_gen_in_flight:
+                messagebox.showwarning(
+                    "Ripristino non disponibile",
+                    "È in corso (o in attesa) la pubblicazione della dashboard.\nRiprova al termine del caricamento."
+                )
+                return
             if not messagebox.askyesno(
                 "Conferma ripristino",
                 "Questa operazione sovrascriverà il database corrente.\nProcedere?",
                 icon="warning",
             ):
                 return
-            shutil.copy2(filepath, DB_PATH)
+            restore_db_file(filepath)
+            self.chart_cache = None
             messagebox.showinfo(
                 "Ripristino completato",
                 "Il database è stato ripristinato con successo.\nRiavvia l'applicazione per essere certo di leggere i dati aggiornati."
@@ -1434,16 +2080,43 @@ class App(tk.Tk):
             "Dashboard",
             "La dashboard ora viene sempre generata nella cartella fissa:\n\n"
             f"{DASH_DIR}\n\nIl file principale è 'index.html'.\n"
+            f"Le copie storiche sono salvate in:\n{DASH_ARCHIVE_DIR}\n\n"
             "Aggiungi qui dentro 'chart.umd.min.js' se vuoi la modalità OFFLINE."
         )
 
     def manual_generate_dashboard(self):
-        try:
-            latest, tsfile = self._generate_dashboard_to_fixed_dir()
-            messagebox.showinfo("Dashboard", f"Dashboard rigenerata:\n{os.path.join(DASH_DIR,'index.html')}\n\nCopia storica:\n{tsfile}")
-            self.status.set(f"Dashboard aggiornata: {os.path.join(DASH_DIR,'index.html')}")
-        except Exception as e:
-            messagebox.showwarning("Dashboard", f"Impossibile generare la dashboard:\n{e}")
+        # Sullo stesso worker degli upload: una generazione alla volta, mai in parallelo
+        # a quella di un deploy (stessi file in DASH_DIR)
+        use_offline = bool(self.config_data.get("chart_offline"))
+        self._manual_gen_in_flight += 1
+        def _done(result):
+            self._manual_gen_in_flight -= 1
+            ok, value = result
+            if ok:
+                messagebox.showinfo("Dashboard", f"Dashboard rigenerata:\n{INDEX_PATH}\n\nCopia storica:\n{value[1]}")
+                self.status.set(f"Dashboard aggiornata: {INDEX_PATH}")
+            else:
+                messagebox.showwarning("Dashboard", f"Impossibile generare la dashboard:\n{value}")
+        def _worker():
+            try:
+                result = (True, self._generate_dashboard_to_fixed_dir(use_offline))
+            except Exception as e:
+                result = (False, e)
+            try:
+                self.after(0, _done, result)
+            except (RuntimeError, tk.TclError):
+                pass  # finestra già chiusa
+        self.status.set("Generazione dashboard in corso…")
+        _upload_executor.submit(_worker)
+
+    def refresh_tools(self):
+        clear_tool_cache()
+        surge_cmd = _find_tool("surge")
+        npx_cmd = _find_tool("npx")
+        messagebox.showinfo(
+            "Strumenti surge",
+            f"surge: {surge_cmd or 'non trovato'}\nnpx: {npx_cmd or 'non trovato'}"
+        )
 
     def copy_chart_js_to_dashboard(self):
         src = filedialog.askopenfilename(
@@ -1455,9 +2128,8 @@ class App(tk.Tk):
             return
         try:
             os.makedirs(DASH_DIR, exist_ok=True)
-            dst = os.path.join(DASH_DIR, "chart.umd.min.js")
-            shutil.copy2(src, dst)
-            messagebox.showinfo("Chart.js", f"Copiato in:\n{dst}\n\nOra puoi abilitare 'Usa Chart.js offline'.")
+            shutil.copy2(src, CHART_JS_PATH)
+            messagebox.showinfo("Chart.js", f"Copiato in:\n{CHART_JS_PATH}\n\nOra puoi abilitare 'Usa Chart.js offline'.")
         except Exception as e:
             messagebox.showerror("Chart.js", f"Errore durante la copia:\n{e}")
 